@@ -10,45 +10,145 @@
 # webpages and prints out a tree structure of these links at the end. The crawler can handle both HTML and XML content.
 #
 # Pseudo Code:
-# - Import the necessary libraries: requests, BeautifulSoup, urllib.parse, lxml (if used)
+# - Import the necessary libraries: requests, urllib.parse, lxml
 # - Define functions for downloading web pages, extracting links, performing web crawling, and printing the link tree.
 # - Set the starting URL and maximum depth for crawling.
-# - Initialize data structures (visited_links, link_graph) and a stack for traversal.
-# - While the stack is not empty and the maximum depth is not reached:
-#   - Pop a URL from the stack.
-#   - Download the page content.
-#   - Extract links from the page.
+# - Initialize data structures (visited_links, link_graph) and a frontier of pages for traversal.
+# - While the frontier is not empty and the maximum depth is not reached:
+#   - Download every page of the frontier concurrently.
+#   - Extract links from each page.
 #   - Store the link relationship between the current URL and its parent URL.
-#   - Add the child links to the stack.
+#   - Add the child links to the next frontier.
 # - Print the link tree.
 #
 # Note:
 # - Ensure that the 'lxml' library is installed for parsing both HTML and XML content.
-# - Be responsible and respect website terms of service and robots.txt files when web crawling.
-# - To install Language_check pip will not work.
-#       git clone -b patch-1 https://github.com/SpartorA/language-check.git
-#       python setup.py install
+# - Be responsible and respect website terms of service when web crawling. Pages disallowed by robots.txt are
+#   skipped (listed in the link tree marked -ROBOTS) and no more than MAX_PER_HOST downloads run against a host at
+#   the same time, whatever --threads is set to.
+# - The punctuation check uses language_tool_python, which needs Java. It downloads LanguageTool the first time
+#   and keeps one LanguageTool server running for the whole crawl.
 #
 # Usage:
 #   USAGE: webpage --url|-u --anchor|-a anchor --depth|-d depth_level [--brokenlinks|-b] [--spelling|-s] [--writefiles|-w] [--punctuation|-p] 
-#                                                                     [--naughtywordlist|-n] [--verbose|-v] [--help|-h]
+#                                                                     [--naughtywordlist|-n] [--threads|-t threads] [--cache|-c] [--verbose|-v] [--help|-h]
 #
 #   Examples:
 #     python webpage.py -b -s -p -u https://site -a site -d  4 >  webpage.txt
 #     python webpage.py -w -u https://site -a site -d  4 >  webpage.txt
 
 import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urlparse, urljoin
-import lxml 
+import requests_cache
+from urllib3.util.retry import Retry
+from urllib.parse import urlparse, urljoin, urlsplit, urlunsplit
+from urllib.robotparser import RobotFileParser
+import lxml.html
+from lxml import etree
 import enchant
 import string
+import sys
+import threading
+import multiprocessing
 import re
-import language_check
+import language_tool_python
 
 import argparse
-
-def usage(write_files,broken_links, spelling, punctuation, naughty_wordlist, verbose, url, anchor, depth):
+import io
+from collections import defaultdict
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+
+MAX_WORKERS = 32  # Default for how many pages are downloaded at the same time
+MAX_PER_HOST = 4  # Downloads from one host at the same time, to be polite to the server
+USER_AGENT = "XY"  ## Work around 406 errors.
+MAX_PAGE_BYTES = 5_000_000  # Larger webpages are not read
+DEFAULT_PORTS = {"http": 80, "https": 443}
+PAGE_TYPES = {"text/html", "application/xhtml+xml", "text/xml", "application/xml"}  # Content-Types read as webpages
+
+CACHE_NAME = "webpage_cache"  # SQLite file (webpage_cache.sqlite) holding the responses kept by --cache
+CACHE_SECONDS = 3600  # How long a cached response is used before it is downloaded again
+
+# Function to get the media type of a response ("text/html" if the server does not say)
+def media_type(response):
+    return response.headers.get("Content-Type", "text/html").partition(";")[0].strip().lower()
+
+# Function to decide if the cache may keep a response. The cache reads the whole body of what it keeps,
+# so only webpages known to be within MAX_PAGE_BYTES are kept (not pdfs, archives, or pages of unknown size)
+def cacheable(response):
+    content_length = response.headers.get("Content-Length", "")
+    return media_type(response) in PAGE_TYPES and content_length.isdigit() and int(content_length) <= MAX_PAGE_BYTES
+
+# Function to create the HTTP session, with a response cache on disk if asked for
+def make_session(cache=False):
+    if cache:
+        # Only good (200) responses are cached, so broken links are always checked again
+        session = requests_cache.CachedSession(CACHE_NAME, backend="sqlite", expire_after=CACHE_SECONDS, filter_fn=cacheable)
+    else:
+        session = requests.Session()
+    # Compressed pages are decoded by urllib3 (brotli needs the brotli package)
+    session.headers.update({"User-Agent": USER_AGENT, "Accept-Encoding": "gzip, deflate, br"})
+    # Try again on errors that are usually temporary, so they are not reported as broken links.
+    # Retry-After is ignored: the wait holds a host slot and the whole wave, and a server may ask for hours
+    retries = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504), respect_retry_after_header=False)
+    adapter = requests.adapters.HTTPAdapter(pool_connections=32, pool_maxsize=64, max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# One session for the whole crawl so connections to a host are kept alive and reused
+SESSION = make_session()
+
+# robots.txt rules per host ("scheme://host"), each read once per run
+ROBOTS = {}
+# Semaphores limiting the downloads running against each host
+HOST_SLOTS = defaultdict(lambda: threading.BoundedSemaphore(MAX_PER_HOST))
+HOST_SLOTS_LOCK = threading.Lock()
+
+# Initialize the spell checker
+SPELL_CHECKER = enchant.request_dict("en_US")  # You can change "en_US" to the desired language
+
+HTML_PARSER = lxml.html.HTMLParser(encoding="utf-8")  # Pages are handed to lxml as UTF-8 bytes
+HREF_XPATH = etree.XPath('//a/@href')  # Compiled once, evaluated in C on every page
+
+# Text clean up and word filters, compiled once instead of for every page/word
+CONTROL_CHARS = ''.join(map(chr, [*range(0x00, 0x20), *range(0x7F, 0xA0)]))
+# Remove sentence punctuation. Remove word punct (to keep): dash, appostropy, slash (webpages), and underscore (git program references)
+# Period is a special case due to webpages and other program references. So check these word by word and discard only periods at the end
+SENTENCE_PUNCTUATION = string.punctuation.replace('-','').replace("'", "").replace("/","").replace("_","").replace(".","")
+# Both are deleted by one str.translate pass
+PUNCTUATION_TRANSLATOR = str.maketrans('', '', CONTROL_CHARS + SENTENCE_PUNCTUATION)
+# Space separated words. Remove only sentence periods. Discard words that embed a period. Also discard words with _ or /
+WORD_SPLIT_RE = re.compile(r'(?<!\S)([^\s./_]+)\.*(?!\S)')
+# Scheme to drop and slashes to turn into dashes when a url becomes a file name
+FILE_NAME_RE = re.compile(r'^[a-z]+://|/')
+# Words worth a spell check, in one pass: 5 letters or more, not mashed together words (fooBar), not acronyms
+WORD_RE = re.compile(r'(?!.*[a-z][A-Z][a-z]+$)(?!.*[A-Z][A-Z]).{5,}')
+
+# Words the spell checker does not know but are fine on these webpages
+OK_WORDS = frozenset({
+    'elastiflow', 'sublicense', 'sublicenses', 'decompile', 'humanreadable', 'nonpersonally', 'splunk', 'sflow',
+    'namespaced', 'elasticsearch', 'analytics', 'cyber', 'ebooks', 'codespaces', 'kibana', 'distro', 'cowart', 'flagbased',
+    'glibc', 'redpanda', 'netflow', 'changelog', 'uptodate', 'maxmind', 'junos', 'roadmap', 'stdout', 'cribl',
+    'serverclass', 'multinode', 'realtime', 'flowsec', 'xsmall', 'xlarge', 'virtualized', 'singlemode', 'rackawareness',
+    'grafana', 'flowssec', 'lifecycle', 'logstash', 'dockerfile', 'fortinet', 'fortigate', 'citrix', 'plixer', 'ziften',
+    'pensando', 'cubro', 'gigamon', 'geospatial', 'tcpdump', 'pluribus', 'pmacct', 'procera', 'netscaler', 'sandvine',
+    'antrea', 'trammellch', 'cognitix', 'calix', 'recordssecond', 'remediate', 'telco', 'performant', 'unsampled', 'amasol',
+    'hubspot', 'licensors', 'cyberattack', 'cyberattacks', 'reimagined', 'vmware', 'namespace', 'namespaces', 'encap',
+    'tanzu', 'logzio', 'ipaddr', 'hostname', 'async', 'enricher', 'config', 'lookup', 'lookups', 'reindexed', 'reindexing',
+    'reindex', 'changeme', 'kubernetes', 'linux', 'natively', 'jsonpretty', 'nameserver', 'inband', 'schema', 'schemas',
+    'opensearch', 'floweval', 'multicloud', 'digitalization', 'samplicator', 'geoscheme', 'datagrams', 'phion',
+    'renewables', 'squarespace', 'clickstream', 'exfiltration', 'deliverables', 'enrichers', 'atlanta', 'flowcoll',
+    'sonicwall', 'efauthpassword', 'efprivpassword', 'systemd', 'downsampling', 'liveness', 'serverless', 'viptela',
+    'splunkbase', 'filesystem', 'ubiquiti', 'hsflowd', 'mikrotik', 'riskiq', 'errored', 'kafka', 'sophos', 'astaro',
+    'netintact', 'velocloud', 'vxlan', 'codec', 'filebeat', 'appname', 'webhook', 'fortigatelab', 'hostnames', 'robcowart',
+    'manousos', 'solarwinds', 'germain', 'geolocation', 'geolite', 'ndjson', 'systemct', 'goller', 'annika', 'wickert',
+    'freie', 'netze', 'mainimport', 'timefunc', 'remediating', 'noauth', 'nopriv', 'packetparser', 'flowsets', 'libpcap',
+    'powertools', 'systemctl', 'signup', 'boolean', 'runtime', 'misconfiguration', 'anonymizing', 'subnet', 'msgid',
+    'ident', 'sdwan', 'uptime',
+})
+
+def usage(write_files,broken_links, spelling, punctuation, naughty_wordlist, verbose, url, anchor, depth, threads, cache):
     # Create argument parser
     parser = argparse.ArgumentParser(description="Webpage tool")
 
@@ -62,6 +162,8 @@ def usage(write_files,broken_links, spelling, punctuation, naughty_wordlist, ver
     parser.add_argument('-u','--url', action="store", type=str, dest="url", required=True, help='Web address to start at and follow all links.')
     parser.add_argument('-a','--anchor', action="store", type=str, dest="anchor", help='Only check websites with this string or whoms parents have this string.')
     parser.add_argument('-d','--depth', action="store", type=str, dest="depth", help='Limit how many links to hop from the original url.')
+    parser.add_argument('-c','--cache', action="store_true", dest="cache", help='Keep downloaded webpages in a local cache for an hour to speed up reruns.')
+    parser.add_argument('-t','--threads', action="store", type=int, dest="threads", default=threads, help=f'How many webpages to download at the same time (no more than {MAX_PER_HOST} from one host).')
     #parser.add_argument('-H','--help', action="store_true", dest="help_message")
 
     # Parse the command-line arguments
@@ -75,6 +177,8 @@ def usage(write_files,broken_links, spelling, punctuation, naughty_wordlist, ver
     url = args.url
     depth = args.depth
     anchor = args.anchor
+    threads = args.threads
+    cache = args.cache
 
     # If verbose, let user know
     if verbose:
@@ -89,47 +193,133 @@ def usage(write_files,broken_links, spelling, punctuation, naughty_wordlist, ver
         url              = {url}
         depth            = {depth}
         anchor           = {anchor}
+        threads          = {threads}
+        cache            = {cache}
         """)
 
     # Implied -H or --help OR the command arguments do not make sense.
-    if not url or not depth or not anchor or not any([broken_links, spelling, write_files]):
-        print("USAGE: webpage url|-u --anchor|-a anchor --depth|-d depth_level [--brokenlinks|-b] [--spelling|-s] [--writefiles|-w] [--punctuation|-p] [--naughtywordlist|-n] [--verbose|-v] [--help|-h]")
+    if not url or not depth or not anchor or not any([broken_links, spelling, write_files]) or threads < 1:
+        print("USAGE: webpage url|-u --anchor|-a anchor --depth|-d depth_level [--brokenlinks|-b] [--spelling|-s] [--writefiles|-w] [--punctuation|-p] [--naughtywordlist|-n] [--threads|-t threads] [--cache|-c] [--verbose|-v] [--help|-h]")
         exit(-1)
-    return write_files,broken_links,spelling,punctuation,naughty_wordlist,verbose,url,anchor,depth
+    return write_files,broken_links,spelling,punctuation,naughty_wordlist,verbose,url,anchor,depth,threads,cache
 
-# Function to download the contents of a webpage
+# Function to give a url one canonical spelling, interned so every copy of it in the crawl is the same string
+def canonical_url(url):
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    try:
+        if parts.port is not None and parts.port == DEFAULT_PORTS.get(scheme):
+            netloc = netloc.rpartition(":")[0]  # http://site:80/ is http://site/
+    except ValueError:  # Not a number, leave the port alone
+        pass
+    path = parts.path or ("/" if netloc else "")
+    return sys.intern(urlunsplit((scheme, netloc, path, parts.query, "")))  ## Ignore placement reference (if exists)
+
+# Function to get the key visited_links remembers a page by: /foo and /foo/ are the same page.
+# (Relative links on the page are resolved against the url the server answered from, see download_page)
+def page_key(url):
+    parts = urlsplit(url)
+    if len(parts.path) > 1 and parts.path.endswith("/"):
+        return sys.intern(urlunsplit(parts._replace(path=parts.path.rstrip("/") or "/")))
+    return url
+
+# Function to get the robots.txt host ("scheme://host") of a url (None if not a web page)
+def robots_host(url):
+    parts = urlparse(url)
+    if parts.scheme in ("http", "https") and parts.netloc:
+        return parts.scheme + "://" + parts.netloc.lower()
+    return None
+
+# Function to read the robots.txt of a host. Like RobotFileParser.read, 401/403 disallow everything and other
+# 4xx allow everything. A server error (still there after the retries) also disallows everything for the run,
+# as RFC 9309 asks. Only a host that cannot be reached at all is allowed
+def load_robots(host):
+    robots = RobotFileParser(host + "/robots.txt")
+    try:
+        response = SESSION.get(robots.url, timeout=10)
+        if response.status_code in (401, 403) or response.status_code >= 500:
+            robots.disallow_all = True
+        elif response.status_code >= 400:
+            robots.allow_all = True
+        else:
+            robots.parse(response.text.splitlines())
+    except requests.exceptions.RetryError as e:  # 429/5xx on every try (see make_session)
+        print(f"Not crawling {host}, its robots.txt could not be read: {e}")
+        robots.disallow_all = True
+    except requests.exceptions.RequestException:
+        robots.allow_all = True
+    ROBOTS[host] = robots
+
+# Function to check if robots.txt lets us download a url
+def allowed_by_robots(url):
+    host = robots_host(url)
+    return host is None or ROBOTS[host].can_fetch(USER_AGENT, url)
+
+# Function to download the contents of a webpage ("" if the link works but it is not a webpage, None if broken)
+# and the url it came from after redirects (relative links on the page are resolved against it)
 def download_page(parent_url,url):
+    with HOST_SLOTS_LOCK:
+        host_slot = HOST_SLOTS[urlparse(url).netloc.lower()]
     try:
-        response = requests.get(url, headers={"User-Agent": "XY"})  ## Work around 406 errors.
-        response.raise_for_status()  # Check for HTTP errors
-        #print(f"{parent_url} => {url} is OK with {response.status_code} .")
-        return response.text
+        with host_slot, SESSION.get(url, timeout=10, stream=True) as response:
+            response.raise_for_status()  # Check for HTTP errors
+            #print(f"{parent_url} => {url} is OK with {response.status_code} .")
+            base_url = canonical_url(response.url)  # /dir is redirected to /dir/
+
+            # The link works, but only HTML/XML bodies are worth reading (not pdfs, images, archives, ...)
+            if media_type(response) not in PAGE_TYPES:
+                return "", base_url
+            content_length = response.headers.get("Content-Length", "")
+            if content_length.isdigit() and int(content_length) > MAX_PAGE_BYTES:
+                print(f"Not reading page {url} from {parent_url}: larger than {MAX_PAGE_BYTES} bytes")
+                return "", base_url
+
+            # Read the body, giving up as soon as it grows past the limit (Content-Length may be missing)
+            body = bytearray()
+            for chunk in response.iter_content(chunk_size=65536):
+                body += chunk
+                if len(body) > MAX_PAGE_BYTES:
+                    print(f"Not reading page {url} from {parent_url}: larger than {MAX_PAGE_BYTES} bytes")
+                    return "", base_url
+        try:
+            return body.decode(response.encoding or "utf-8", errors="replace"), base_url
+        except LookupError:  # Unknown charset sent by the server
+            return body.decode("utf-8", errors="replace"), base_url
     except requests.exceptions.RequestException as e:
         print(f"Error on page {parent_url} when downloading {url}: {e}")
+        return None, url
+
+# Function to parse an HTML page with lxml (None if there is nothing to parse)
+def parse_html(html_content):
+    try:
+        # Encode first: lxml refuses str input that carries an XML encoding declaration
+        return lxml.html.fromstring(html_content.encode("utf-8"), parser=HTML_PARSER)
+    except etree.ParserError:
         return None
 
 # Function to extract links from an HTML page
 def extract_links(html_content, base_url):
     links = set()
-    parser = "lxml"  # Use lxml as the parser
-    soup = BeautifulSoup(html_content, parser)
-    for a_tag in soup.find_all('a', href=True):
-        link = urljoin(base_url, a_tag['href'])
-        link = link.split('#')[0] ## Ignore placement reference (if exists)
-        links.add(link)
+    document = parse_html(html_content)
+    if document is not None:
+        for href in HREF_XPATH(document):
+            links.add(canonical_url(urljoin(base_url, href)))
     return links
 
+# Function to get the text a reader sees on a page, each piece of text separated by a space
+def extract_text(html_content):
+    document = parse_html(html_content)
+    if document is None:
+        return ""
+    # Scripts, style sheets and comments are not part of the page text
+    etree.strip_elements(document, etree.Comment, etree.ProcessingInstruction, "script", "style", "template", with_tail=False)
+    return " ".join(document.itertext())
+
 # Function to translate string to a string of words
 def process_string(input_string, verbose):
-    # Remove control characters using regular expression
-    input_string = re.sub(r'[\x00-\x1F\x7F-\x9F]', '', input_string)
-
-    # Remove sentence punctuation. Remove word punct (to keep): dash, appostropy, slash (webpages), and underscore (git program references)
-    # Period is a special case due to webpages and other program references. So check these word by word and discard only periods at the end
-    sentence_punctuation=string.punctuation.replace('-','').replace("'", "").replace("/","").replace("_","").replace(".","")
-
-    translator = str.maketrans('', '', sentence_punctuation)
-    input_string = input_string.translate(translator)
+    # Remove control characters and sentence punctuation (see SENTENCE_PUNCTUATION)
+    input_string = input_string.translate(PUNCTUATION_TRANSLATOR)
     if verbose:
         try:
             print("WITHOUT PUNCTUATION:\n" + input_string)
@@ -139,28 +329,26 @@ def process_string(input_string, verbose):
             print(output_string)
             #print("WITHOUT PUNCTUATION:\n  Cannot print due to error:", e)
 
-    # Split the string by spaces
-    temp_words = input_string.split()
-    words = []
+    # Split the string by spaces, in one regex pass (see WORD_SPLIT_RE)
+    return WORD_SPLIT_RE.findall(input_string)
 
-    # Remove only sentence periods. Discard words that embed a period. Also discard words with _ or /
-    for word in temp_words:
-        temp_word = word.rstrip('.')
-        if '.' not in temp_word and '/' not in temp_word and '_' not in temp_word:
-            words.append(temp_word)
-    return words
+# Function to ask the spell checker about a word. Headers, menus and footers repeat on every page of a
+# site, so the answers are remembered for the whole crawl (by each parse process)
+@lru_cache(maxsize=50000)
+def is_misspelled(word):
+    ## Check if company or other capitalized word
+    return not SPELL_CHECKER.check(word) and not SPELL_CHECKER.check(word.capitalize())
 
-# Function to check spelling
-def spell_check_html_xml(input_string,spell_checker,verbose):
+# Function to get the spell checker's suggestions for a misspelled word (slow, and the same typo is often on many pages)
+@lru_cache(maxsize=10000)
+def spelling_suggestions(word):
+    return SPELL_CHECKER.suggest(word)
 
-    # Parse the HTML/XML content using BeautifulSoup
-    #parser = "html.parser"
-    parser = "lxml"  # Use lxml as the parser
-    soup = BeautifulSoup(input_string, parser)
-    #print(soup)
+# Function to check spelling
+def spell_check_html_xml(input_string,verbose):
 
-    # Extract the text content from the parsed document
-    text_content = soup.get_text(" ")
+    # Extract the text content of the HTML/XML document
+    text_content = extract_text(input_string)
     if verbose:
         try:
             print("WEBPAGE:\n" + text_content)
@@ -174,38 +362,21 @@ def spell_check_html_xml(input_string,spell_checker,verbose):
     #cleaned_string = ''.join(char for char in text_content if char.isalpha())
     #words = cleaned_string.split()
 
-    pattern1 = r'^.*[a-z][A-Z][a-z]+$' # Detect mashed together words to ignore
-    pattern2 = r'^.*[A-Z][A-Z].*$'  ## Ignore Acronyms
+    # Get rid of single quoted words (but keep appostrophies). Keep each word once, in the order first seen,
+    # so a word that repeats all over the page only goes through the checks one time
+    unique_words = dict.fromkeys(word.rstrip("'").lstrip("'") for word in words)
 
     # Initialize a list to store misspelled words
     misspelled_words = []
-#   ok_words = ['elastiflow', 'sublicense', 'sublicenses', 'decompile', 'humanreadable', 'nonpersonally', 'splunk', 'sflow', 'namespaced', 'elasticsearch', 'analytics', 'cyber', 'ebooks', 'codespaces', 'kibana', 'distro', 'cowart', 'flagbased', 'glibc', 'redpanda', 'netflow', 'changelog', 'uptodate', 'maxmind', 'junos', 'roadmap', 'stdout', 'cribl', 'serverclass', 'multinode', 'realtime', 'flowsec', 'xsmall', 'xlarge', 'virtualized', 'singlemode', 'rackawareness', 'grafana', 'flowssec', 'lifecycle', 'logstash', 'dockerfile', 'fortinet', 'fortigate', 'citrix', 'plixer', 'ziften', 'pensando', 'cubro', 'gigamon', 'geospatial', 'tcpdump', 'pluribus', 'pmacct', 'procera', 'netscaler', 'ziften', 'pensando', 'sandvine', 'antrea', 'trammellch', 'cognitix', 'calix', 'recordssecond', 'remediate', 'telco','performant', 'unsampled', 'amasol', 'hubspot', 'licensors', 'cyberattack', 'cyberattacks', 'unsampled', 'reimagined', 'vmware', 'namespace', 'namespaces', 'encap', 'tanzu', 'logzio', 'ipaddr', 'hostname', 'async', 'enricher', 'config', 'lookup', 'lookups', 'reindexed', 'reindexing', 'reindex', 'changeme', 'kubernetes', 'linux', 'natively', 'jsonpretty', 'nameserver', 'inband', 'schema', 'schemas', 'opensearch', 'floweval', 'multicloud', 'digitalization', 'samplicator', 'geoscheme', 'datagrams', 'phion', 'renewables', 'squarespace', 'clickstream', 'exfiltration', 'deliverables', 'enrichers', 'atlanta', 'flowcoll', 'sonicwall', 'efauthpassword', 'efprivpassword', 'systemd', 'downsampling', 'liveness', 'sonicwall', 'downsampling', 'serverless', 'viptela', 'splunkbase', 'filesystem', 'ubiquiti', 'hsflowd', 'mikrotik', 'riskiq', 'errored', 'kafka', 'sophos', 'astaro', 'phion', 'netintact', 'velocloud', 'vxlan', 'codec', 'filebeat', 'appname', 'webhook', 'fortigatelab', 'hostnames', 'robcowart', 'manousos', 'solarwinds', 'germain', 'geolocation', 'geolite', 'ndjson', 'systemct', 'goller', 'annika', 'wickert', 'freie', 'netze', 'manousos', 'mainimport', 'timefunc', 'remediating', 'noauth', 'nopriv', 'packetparser', 'flowsets', 'libpcap', 'powertools', 'systemctl', 'signup', 'boolean', 'runtime', 'misconfiguration', 'anonymizing', 'subnet', 'msgid', 'ident', 'sdwan', 'uptime']
 
     # Check the spelling of each word and add misspelled words to the list
-    for word in words:
-        ## Get rid of single quoted words (but keep appostrophies)
-        word=word.rstrip("'").lstrip("'")
-        ## Have we already checked this time?
-        if word not in misspelled_words:
-            ## No numbers, only words with all letters
-            if word.isalpha():
-                ## Must be 3 letters or more
-                if len(word) > 4:
-                    ## Ignore mashed together words
-                    match = re.match(pattern1, word)
-                    if not match:
-                        ## Ignore acronyms
-                        match = re.match(pattern2, word)
-                        if not match:
-                            ## Check list of exceptions
-                            if word.lower() not in ok_words:
-                                ## Ignore Webpages and Git/program references with '_'
-                                #if not word.endswith("com") and not word.startswith('http') and '/' not in word and '_' not in word:
-                                if '_' not in word:
-                                    if not spell_checker.check(word):
-                                        ## Check if company or other capitalized word
-                                        if not spell_checker.check(word.capitalize()):
-                                            misspelled_words.append(word)
+    for word in unique_words:
+        ## No numbers or '_' (Git/program references), only words with all letters. Then see WORD_RE
+        if word.isalpha() and WORD_RE.fullmatch(word):
+            ## Check list of exceptions
+            if word.lower() not in OK_WORDS:
+                if is_misspelled(word):
+                    misspelled_words.append(word)
 
     # Return the list of misspelled words
     #try:
@@ -214,96 +385,155 @@ def spell_check_html_xml(input_string,spell_checker,verbose):
     #    print("Misspelled Words:\n  Cannot print due to error:", e)
     return misspelled_words
 
-# Function to perform web crawling
-def crawl_web(start_url, max_depth, anchor, verbose, broken_links, spelling, write_files, punctuation, visited_links, link_graph, stack, i):
+# Function to turn a url into a piece of a file name: https://site/a/b?x=1 -> site-a-b
+def url_file_name(url):
+    return FILE_NAME_RE.sub(lambda match: "-" if match.group() == "/" else "", url.partition('?')[0])
 
-    # Initialize the spell checker
-    spell_checker = enchant.request_dict("en_US")  # You can change "en_US" to the desired language
+# Function to write a webpage to a file, in one buffered write of UTF-8 bytes
+def write_page(file_name, html_content):
+    with open(file_name, "wb", buffering=1 << 20) as file:
+        file.write(html_content.encode("utf-8", "replace"))
 
-    while stack:
-        current_url, parent_url, depth = stack.pop()
-        if current_url not in visited_links and depth <= max_depth:
-            if verbose:
-                print(f"Crawling {current_url}, Depth: {depth} of {max_depth}")
+# Function to do the CPU heavy work on a webpage, run in the parse processes (each has its own SPELL_CHECKER)
+def parse_page(html_content, base_url, follow_links, check_spelling, check_grammar, verbose):
+    # Extract links from the current page (only if they are going to be followed)
+    links = set()
+    if follow_links:
+        links = extract_links(html_content, base_url)
+    # The verbose output of the spell check is handed back to be printed by the main process, next to the
+    # rest of the page's output (printed here it would come out of order on a redirected stdout)
+    misspelled_words = []
+    verbose_output = io.StringIO()
+    if check_spelling:
+        with redirect_stdout(verbose_output):
+            misspelled_words = spell_check_html_xml(html_content,verbose)
+    # Text for the grammar check (the LanguageTool server is only called from the main process)
+    text_content = ""
+    if check_grammar:
+        text_content = extract_text(html_content)
+    return links, misspelled_words, text_content, verbose_output.getvalue()
+
+# Function to perform web crawling
+# (executor is the pool of download threads, parse_pool the pool of processes for the CPU heavy work)
+def crawl_web(start_url, max_depth, anchor, verbose, broken_links, spelling, write_files, punctuation, visited_links, link_graph, frontier, i, executor, parse_pool):
+
+    # Every url ever put on the frontier, so a page linked from many places is only queued once
+    enqueued = {page_key(current_url) for current_url, parent_url, depth in frontier}
+
+    # Breadth first: every page of a depth level is downloaded concurrently, then processed in order
+    while frontier:
+        # Pick the pages of this wave that still need a visit
+        wave = []
+        for current_url, parent_url, depth in frontier:
+            if page_key(current_url) not in visited_links and depth <= max_depth:
+                wave.append((current_url, parent_url, depth))
+                if verbose:
+                    print(f"Crawling {current_url}, Depth: {depth} of {max_depth}")
+        frontier = []
+
+        # Read robots.txt of the hosts seen for the first time, then drop the pages they do not allow
+        list(executor.map(load_robots, {robots_host(page[0]) for page in wave} - ROBOTS.keys() - {None}))
+        allowed = []
+        for page in wave:
+            if allowed_by_robots(page[0]):
+                allowed.append(page)
+            else:
+                visited_links.add(page_key(page[0]))
+                # Still listed under its parent, marked as not checked
+                if page[1]:
+                    link_graph[page[1]].append(page[0] + "-ROBOTS")
+                if verbose:
+                    print(f"Skipping {page[0]}, disallowed by robots.txt")
+        wave = allowed
+
+        # Download the pages. The work is network bound so threads overlap the waits.
+        # Each webpage goes to the parse processes as soon as it (and the ones before it) arrived, so parsing
+        # runs while the rest of the wave is still downloading. Results are picked up in order below
+        pages = []
+        parsed = []
+        for (current_url, parent_url, depth), (html_content, base_url) in zip(wave, executor.map(lambda page: download_page(page[1], page[0]), wave)):
+            pages.append(html_content)
+            # Links are followed if we are less than one removed from our main site (or on the first level),
+            # and only if they would not be too deep: they are never queued just to be dropped later
+            follow_links = depth < max_depth and (not parent_url or anchor in parent_url.lower())
+            check_spelling = spelling and anchor in current_url.lower()
+            if html_content and (follow_links or check_spelling or punctuation):
+                parsed.append(parse_pool.submit(parse_page, html_content, base_url, follow_links, check_spelling, bool(punctuation), verbose))
+            else:
+                parsed.append(None)  # Nothing to parse
+
+        # Grammar check the webpages of the wave at the same time, as their text comes back from the parse processes.
+        # Each check is a request to the LanguageTool server, which works on them in parallel
+        grammar = [None] * len(wave)
+        if punctuation:
+            grammar = list(executor.map(lambda parse_job: punctuation.check(parse_job.result()[2]) if parse_job else None, parsed))
 
-            # Download the page
-            html_content = download_page(parent_url,current_url)
+        writes = []  # Webpages being written to files
+        for (current_url, parent_url, depth), html_content, parse_job, matches in zip(wave, pages, parsed, grammar):
             if html_content is not None:
-                visited_links.add(current_url)
-                
+                visited_links.add(page_key(current_url))
+
+                # Store the link relationship between current_url and parent_url
+                if parent_url:
+                    link_graph[parent_url].append(current_url)
+
+                # Nothing to check or follow in files that are not webpages (see download_page)
+                if not html_content:
+                    continue
+                links, misspelled_words, _, verbose_output = parse_job.result() if parse_job else (set(), [], "", "")
+                if verbose_output:
+                    print(f"Parsed {current_url}")
+                    try:
+                        sys.stdout.write(verbose_output)
+                    except Exception as e:
+                        print(verbose_output.encode("UTF-8"))
+
                 # Write files
                 if write_files:
                     if anchor in current_url.lower():
-                      #parser = "lxml"  # Use lxml as the parser
-                      #soup = BeautifulSoup(html_content, parser)
-                      #text_content = soup.get_text(" ")
-                      file_name = ''
-                      if parent_url:
-                          file_name = parent_url.replace("/","-").replace("http:","").replace("https:","").replace("--","").split('?')[0] + "__" + current_url.replace("/","-").replace("http:","").replace("https:","").replace("--","").split('?')[0] + ".txt"
-                      else:
-                          file_name = "ROOT__" + current_url.replace("/","-").replace("http:","").replace("https:","").replace("--","").split('?')[0] + ".txt"
+                      #text_content = extract_text(html_content)
+                      file_name = f"{url_file_name(parent_url) if parent_url else 'ROOT'}__{url_file_name(current_url)}.txt"
                       if len(file_name) > 80:
-                          file_name = file_name[76:] + ".txt"
-                      with open(file_name, "w", encoding="utf-8") as file:
-                      #   file.write(text_content)
-                          file.write(html_content)
-
-                # Check spelling of webpage
-                if spelling:
-                    if anchor in current_url.lower():
-                        misspelled_words = spell_check_html_xml(html_content,spell_checker,verbose)
-                        if misspelled_words:
-                          print("\n")
-                          print(f"Misspellings on {current_url}")
-                          for word in misspelled_words:
-                            try:
-                                print(word + " suggestions: " + str(spell_checker.suggest(word)))
-                                #print(word)
-                            except Exception as e:
-                                print("Could not print out word or suggestions due the the error:", e)
-                          print("\n")
+                          file_name = file_name[-80:]  # Keep the end: the page's own name and the .txt
+                      # Written by a download thread so the disk I/O overlaps the rest of the crawl
+                      writes.append(executor.submit(write_page, file_name, html_content))
+
+                # Check spelling of webpage (done by parse_page)
+                if misspelled_words:
+                  print("\n")
+                  print(f"Misspellings on {current_url}")
+                  for word in misspelled_words:
+                    try:
+                        print(word + " suggestions: " + str(spelling_suggestions(word)))
+                        #print(word)
+                    except Exception as e:
+                        print("Could not print out word or suggestions due the the error:", e)
+                  print("\n")
 
                 # Check punctuation
                 if punctuation:
                     print(f"Viewing {current_url}, Depth: {depth} of {max_depth}")
-                    # Extract the text content from the parsed document
-                    parser = "lxml"  # Use lxml as the parser
-                    soup = BeautifulSoup(html_content, parser)
-                    text_content = soup.get_text(" ")
-                    matches = punctuation.check(text_content)
                     for mistake in matches:
-                        if "spelling" not in mistake:
+                        if mistake.ruleIssueType != "misspelling":
                             i+=1
                             print(f"Grammar: {i}: {mistake}")
 
-                # Extract links from the current page
-                links = extract_links(html_content, current_url)
-
-                # Store the link relationship between current_url and parent_url
-                if parent_url:
-                    if parent_url not in link_graph:
-                        link_graph[parent_url] = []
-                    link_graph[parent_url].append(current_url)
-
-                # Add the links to the stack with increased depth if we are less than one removed from our main site
-                if parent_url:
-                    if anchor in parent_url.lower():
-                        for link in links:
-                            stack.append((link, current_url, depth + 1))
-
-                ## First Level
-                else:
-                    for link in links:
-                        stack.append((link, current_url, depth + 1))
+                # Add the links to the next wave with increased depth (links is empty when they are not followed).
+                # A link already visited or waiting for a visit is not added again. Sorted so which of /foo and /foo/
+                # is queued (and so every crawl) is the same from run to run, and not up to the set's hash order
+                for link in sorted(links):
+                    key = page_key(link)
+                    if key not in visited_links and key not in enqueued:
+                        link = sys.intern(link)  # Strings coming back from another process are new copies
+                        enqueued.add(key)
+                        frontier.append((link, current_url, depth + 1))
 
             # BROKEN LINK
             else:
-                visited_links.add(current_url)
+                visited_links.add(page_key(current_url))
 
                 # Store the link relationship between current_url and parent_url
                 if parent_url:
-                    if parent_url not in link_graph:
-                        link_graph[parent_url] = []
                     if current_url.lower().startswith("mailto"):
                         link_graph[parent_url].append(current_url)
                     else:
@@ -311,14 +541,25 @@ def crawl_web(start_url, max_depth, anchor, verbose, broken_links, spelling, wri
                             link_graph[parent_url].append(current_url + "-BROKEN")
                         else:
                             link_graph[parent_url].append(current_url)
+
+        # Wait for the files of this wave, so a failed write still stops the crawl
+        for write_job in writes:
+            write_job.result()
     return link_graph
 
 # Function to print the link tree
 def print_link_tree(link_graph, node, level=0):
-    if node in link_graph:
-        for child in link_graph[node]:
-            print("  " * level + "|-- " + child)
-            print_link_tree(link_graph, child, level + 1)
+    # Walk the tree with an explicit stack (no recursion limit) and only expand each page once (no loops)
+    lines = []
+    expanded = {node}
+    stack = [(child, level) for child in reversed(link_graph.get(node, ()))]
+    while stack:
+        child, child_level = stack.pop()
+        lines.append("  " * child_level + "|-- " + child + "\n")
+        if child not in expanded:
+            expanded.add(child)
+            stack.extend((grandchild, child_level + 1) for grandchild in reversed(link_graph.get(child, ())))
+    sys.stdout.write("".join(lines))
 
 # Example usage
 if __name__ == "__main__":
@@ -332,28 +573,41 @@ if __name__ == "__main__":
     url = ""  # Replace with your desired starting URL
     depth = 4  # Maximum depth to crawl
     punctuation = False
+    threads = MAX_WORKERS  # Webpages downloaded at the same time
+    cache = False
 
     # Get and parse commandline arguments
-    write_files,broken_links,spelling,punctuation,naughty_wordlist,verbose,url,anchor,depth = usage(write_files,broken_links, spelling, punctuation, naughty_wordlist, verbose, url, anchor, depth)
+    write_files,broken_links,spelling,punctuation,naughty_wordlist,verbose,url,anchor,depth,threads,cache = usage(write_files,broken_links, spelling, punctuation, naughty_wordlist, verbose, url, anchor, depth, threads, cache)
+    if cache:
+        SESSION = make_session(cache=True)
     depth=int(depth)+1  ## Add 1 for "root", a fictious root node in case multiple links are supplied
     visited_links = set()
 
     # Space delimited list of links allowed, but they all use the same anchor
-    urls = url.split()
+    urls = [canonical_url(link) for link in url.split()]
     top_link = 'root'
-    link_graph = {}  # Dictionary to store the links between webpages
-    link_graph[top_link] = []
-    #stack = [('root', None, -1)] 
-    stack = [] 
+    link_graph = defaultdict(list)  # Dictionary to store the links between webpages
+    frontier = []  # Pages waiting to be downloaded
     if punctuation:
-        punctuation = language_check.LanguageTool('en-US')
+        punctuation = language_tool_python.LanguageTool('en-US')
     i=0 # Count punctuation errors globally
+
+    # One pool of download threads for the whole crawl (every start url)
+    executor = ThreadPoolExecutor(max_workers=threads)
+    # and one pool of processes (one per CPU core) for the HTML parsing and spell checking. Started once, so
+    # each process keeps its spell checker and remembered answers (see is_misspelled) from one start url to the next
+    parse_pool = ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn"))
     for link in urls:
         if verbose:
             print(f"PROCESS LINK: {link}")
         link_graph[top_link].append(link)
-        stack.append((link, None, 0))  # Tuple format: (current_url, parent_url, depth)
-        crawl_web(link, depth, anchor, verbose, broken_links, spelling, write_files, punctuation, visited_links, link_graph, stack, i)
+        frontier.append((link, None, 0))  # Tuple format: (current_url, parent_url, depth)
+        crawl_web(link, depth, anchor, verbose, broken_links, spelling, write_files, punctuation, visited_links, link_graph, frontier, i, executor, parse_pool)
+    executor.shutdown()
+    parse_pool.shutdown()
+
+    if punctuation:
+        punctuation.close()  # Stop the LanguageTool server
 
     # Print the link tree
     print(f"\nLink Tree for {url}:\n")